@@ -1,14 +1,34 @@
+import sys
 from collections import defaultdict
-from typing import List, Tuple, Callable
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple, Callable
 
 import graphviz
 
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for bulk_add_edges
+    np = None
+
+try:
+    from numba import njit, types
+    from numba.typed import Dict as _NumbaDict
+except ImportError:  # optional, bulk_add_edges falls back to pure Python
+    njit = None
+
+
+_TABLE_OPEN = '<table border="1" cellborder="0" cellspacing="0" cellpadding="2">\n'
+_TABLE_CLOSE = '\n</table>'
+
+_PORT_PREFIX = 'port_'
+
 
 class EntityFields:
     def __init__(self, fields: List[str]):
         self._fields = set(fields)
 
-    def _foreign_to()
+    def _foreign_to(self):
+        raise NotImplementedError
 
 
 class Entity:
@@ -19,13 +39,13 @@ class Entity:
     FIELD_ALIGN = 'left'
     FIELD_MIN_WIDTH = '56'
 
-    HEADER_TPLT = '\t<tr><td {attrs}>{field_name}</td></tr>'
-    ROW_TPLT = '\t<tr><td {attrs} port="{field_name}">  {field_name}</td></tr>'
-    TABLE_TPLT = '<table border="1" cellborder="0" cellspacing="0" cellpadding="2">{rows}</table>'
-
     PRIMARY_KEY_IDENTIFIER = 'ID'
     FOREIGN_KEY_IDENTIFIER = 'idx'
 
+    # Rendered rows only depend on the field name, so entities sharing field
+    # names ('id', 'name', ...) share the rendered `<tr>` strings as well.
+    _ROW_CACHE: Dict[str, str] = {}
+
     def __init__(self, tablename: str, fields: List[str] = None):
         """
         fields:
@@ -34,43 +54,49 @@ class Entity:
             ```
         """
         self._tablename = tablename
-        self._fields = [f.lower() for f in fields] if fields else []
-        if 'id' not in self.fields:
-            self.fields.insert(0, 'id')
+        self._display_name = tablename.capitalize()
+        self._set_fields(fields)
+        self._update_html()
 
-        self._html = None
         self._edges = []
 
+    def _set_fields(self, fields: List[str]) -> None:
+        fields = list(map(str.lower, fields)) if fields else []
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        # Ordered tuple for rendering, frozenset for O(1) membership.
+        self._fields = tuple(fields)
+        self._field_set = frozenset(fields)
+        self._build_ports()
+
+    def _build_ports(self) -> None:
+        # Interned so repeated hashing in _linked_edges hits the cached hash
+        self._port = sys.intern(self._tablename)
+        self._ports_by_field = {f: sys.intern(f'{self._tablename}:{f}')
+                                for f in self._fields}
+        self._ports = {_PORT_PREFIX + f: p
+                       for f, p in self._ports_by_field.items()}
+
     def _get_header(self) -> str:
         """Get table header according to table name"""
-        attrs = ''
-        attr_map = {
-            'bgcolor': self.HEADER_BGCOLOR,
-            'width': self.HEADER_MIN_WIDTH,
-            'cellpadding': self.HEADER_CELL_PADDING,
-        }
-        for k, v in attr_map.items():
-            attrs += f'{k}="{v}" '
-        return self.HEADER_TPLT.format(attrs=attrs, field_name=self.tablename.capitalize())
+        return _render_header(self._display_name)
 
     def _get_row(self, field: str) -> str:
-        attrs = ''
-        attr_map = {
-            'align': self.FIELD_ALIGN,
-        }
-        for k, v in attr_map.items():
-            attrs += f'{k}="{v}" '
-        return self.ROW_TPLT.format(attrs=attrs, field_name=field)
-
-    def _get_table(self, hdr: str, rows: str) -> str:
-        rows = '\n'.join(['', hdr, *rows, ''])
-        return self.TABLE_TPLT.format(rows=rows)
+        row = self._ROW_CACHE.get(field)
+        if row is None:
+            row = self._ROW_CACHE[field] = (
+                f'\t<tr><td align="{self.FIELD_ALIGN}" port="{field}">  {field}</td></tr>')
+        return row
+
+    def _get_table(self, hdr: str, rows: Iterable[str]) -> str:
+        return ''.join((_TABLE_OPEN, hdr, '\n', '\n'.join(rows), _TABLE_CLOSE))
 
     def _update_html(self) -> str:
         assert self.fields is not None
         hdr = self._get_header()
-        rows = [self._get_row(field) for field in self.fields]
-        self._html = self._get_table(hdr, rows)
+        rows = map(self._get_row, self.fields)
+        # Interned so identically-shaped tables share one string
+        self._html = sys.intern(self._get_table(hdr, rows))
         return self._html
 
     def edge_to(self, ent, self_port=None):
@@ -82,7 +108,12 @@ class Entity:
 
     @property
     def fields(self):
-        return self._fields[:]
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields: List[str]):
+        self._set_fields(fields)
+        self._update_html()
 
     @property
     def node_name(self) -> str:
@@ -90,18 +121,30 @@ class Entity:
 
     @property
     def label(self) -> str:
-        return '<' + (self._html or self._update_html()) + '>'
+        return f'<{self._html}>'
 
     @property
     def edges(self) -> List[Tuple['Entity', 'Entity', str]]:
         return self._edges
 
-    def __getattribute__(self, name: str, /):
-        if name.startswith('port_') and name[5:] in self.fields:
-            return '{}:{}'.format(self.tablename, name[5:])
-        elif name == 'port':
-            return self.tablename
-        return super().__getattribute__(name)
+    def __getattr__(self, name: str):
+        """Resolve `port_<field>`/`port`, only invoked on attribute misses"""
+        ports = self.__dict__.get('_ports')
+        if ports is not None:
+            port = ports.get(name)
+            if port is not None:
+                return port
+            if name == 'port':
+                return self._port
+        raise AttributeError(name)
+
+
+@lru_cache(maxsize=None)
+def _render_header(display_name: str) -> str:
+    """Render the header row for `display_name`, cached across entities"""
+    return (f'\t<tr><td bgcolor="{Entity.HEADER_BGCOLOR}" width="{Entity.HEADER_MIN_WIDTH}"'
+            f' cellpadding="{Entity.HEADER_CELL_PADDING}">{display_name}</td></tr>')
+
 
 class ERGraph(graphviz.Digraph):
     """
@@ -117,19 +160,29 @@ class ERGraph(graphviz.Digraph):
         super().__init__(*args, **kwargs)
         self.attr('node', shape='plaintext', fontname='Cascadia Code', fontsize='10')
 
-        self.entities = set()
+        # Entities keyed by id() so ownership checks skip hashing the
+        # wrapper; linked edges keyed by a single 'src\x00dst' string,
+        # cheaper to hash than a tuple of two strings.
+        self.entities = {}
         self._linked_edges = set()
-        self._promised_edges = defaultdict(lambda : [])
+        self._promised_edges = defaultdict(list)
 
         assert isinstance(nodes, list)
         for ent in nodes:
             self.node(ent)
 
     def node(self, ent: Entity, *args, **kwargs):
-        assert isinstance(ent, Entity), type(ent) + "is not instance of Entity"
-        super().node(ent.node_name, ent.label, *args, **kwargs)
-        self.entities.add(ent)
-        [f() for f in self._promised_edges.pop(ent, [])]
+        if not isinstance(ent, Entity):
+            raise TypeError(f'{type(ent).__name__} is not instance of Entity')
+        if args or kwargs:
+            super().node(ent.node_name, ent.label, *args, **kwargs)
+        else:
+            # Plain HTML-label node: append the DOT line directly instead of
+            # going through graphviz's per-attribute quoting
+            self.body.append(f'\t{self._quote(ent.node_name)} [label=<{ent._html}>]\n')
+        self.entities[id(ent)] = ent
+        for f in self._promised_edges.pop(ent, ()):
+            f()
         for edge in ent.edges:
             self._add_edge(*edge)
 
@@ -142,8 +195,8 @@ class ERGraph(graphviz.Digraph):
         **kwargs
     ):
         """Create an edge between owned entities"""
-        assert src_ent in self.entities
-        assert dst_ent in self.entities
+        assert id(src_ent) in self.entities
+        assert id(dst_ent) in self.entities
         return self._add_edge(src_ent, dst_ent, src_port, *args, **kwargs)
 
     def _add_edge(
@@ -160,21 +213,95 @@ class ERGraph(graphviz.Digraph):
         one entity not owned, the creation operation is closured and stored, and
         once the missing entity is added, the closure will be executed.
         """
-        src = getattr(src_ent, 'port_'+src_port) if src_port else src_ent.port
-        dst = dst_ent.port
+        src = src_ent._ports_by_field[src_port] if src_port else src_ent._port
+        dst = dst_ent._port
+        key = src + '\x00' + dst
 
-        if (src, dst) in self._linked_edges:
+        if key in self._linked_edges:
             # Duplicated edges are not allowed
             return
 
+        # Fast path: both endpoints already owned, no closure needed
+        if id(src_ent) in self.entities and id(dst_ent) in self.entities:
+            self._emit_edge(src, dst, *args, **kwargs)
+            self._linked_edges.add(key)
+            return
+
         def promised_edge():
-            graphviz.Digraph.edge(self, src, dst, *args, **kwargs)
-            self._linked_edges.add((src, dst))
+            if key in self._linked_edges:
+                # May have become duplicated while pending
+                return
+            self._emit_edge(src, dst, *args, **kwargs)
+            self._linked_edges.add(key)
 
         # There must be at least one node being added into `self.entities`
-        if src_ent not in self.entities:
+        if id(src_ent) not in self.entities:
             self._promised_edges[src_ent].append(promised_edge)
-        elif dst_ent not in self.entities:
+        else:
             self._promised_edges[dst_ent].append(promised_edge)
+
+    def _emit_edge(self, src: str, dst: str, *args, **kwargs):
+        """Append a DOT edge line, bypassing graphviz for the plain case"""
+        if args or kwargs:
+            graphviz.Digraph.edge(self, src, dst, *args, **kwargs)
+        else:
+            self.body.append(f'\t{self._quote_edge(src)} -> {self._quote_edge(dst)}\n')
+
+    def bulk_add_edges(self, src_ids, dst_ids, ports):
+        """Add a large batch of edges given as indices into `ports`
+
+        `ports` is a sequence of port strings (`Entity.port` /
+        `Entity.port_<field>`) whose entities are already owned;
+        `src_ids`/`dst_ids` are equal-length integer sequences indexing
+        into it. Pairs repeated within the batch or already linked are
+        skipped. The within-batch dedup runs through numba when it is
+        installed, which only pays off for very large batches; otherwise
+        a pure-Python pass is used. Returns the mask of new pairs.
+        """
+        if njit is not None:
+            src_ids = np.ascontiguousarray(src_ids, dtype=np.int64)
+            dst_ids = np.ascontiguousarray(dst_ids, dtype=np.int64)
+            mask = _new_edge_mask(src_ids, dst_ids)
         else:
-            promised_edge()
+            mask = _new_edge_mask_py(src_ids, dst_ids)
+
+        body = self.body
+        linked = self._linked_edges
+        for i, new in enumerate(mask):
+            if not new:
+                continue
+            src = ports[src_ids[i]]
+            dst = ports[dst_ids[i]]
+            key = src + '\x00' + dst
+            if key in linked:
+                continue
+            linked.add(key)
+            body.append(f'\t{self._quote_edge(src)} -> {self._quote_edge(dst)}\n')
+        return mask
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _new_edge_mask(src_ids, dst_ids):
+        """Mask the first occurrence of each (src, dst) pair in the batch"""
+        n = src_ids.shape[0]
+        mask = np.zeros(n, dtype=np.bool_)
+        seen = _NumbaDict.empty(types.UniTuple(types.int64, 2), types.boolean)
+        for i in range(n):
+            key = (src_ids[i], dst_ids[i])
+            if key not in seen:
+                seen[key] = True
+                mask[i] = True
+        return mask
+
+
+def _new_edge_mask_py(src_ids, dst_ids):
+    """Pure-Python fallback for `_new_edge_mask`"""
+    seen = set()
+    mask = []
+    for pair in zip(src_ids, dst_ids):
+        new = pair not in seen
+        if new:
+            seen.add(pair)
+        mask.append(new)
+    return mask